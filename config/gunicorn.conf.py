@@ -2,17 +2,53 @@
 Gunicorn configuration file.
 """
 
+import math
 import multiprocessing
 import os
 
+
+def _available_cpus():
+    """Return the number of CPUs this container may actually use.
+
+    multiprocessing.cpu_count() reports the host's cores; inside a pod we want
+    the affinity mask, further capped by the cgroup v2 CPU quota if one is set.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = multiprocessing.cpu_count()
+
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (IOError, ValueError):
+        pass
+
+    return cpus
+
+
+cpus = _available_cpus()
+
 # Server socket
 bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
 backlog = 2048
+# Set SO_REUSEPORT on the listening socket (Linux 3.9+)
+reuse_port = os.getenv('GUNICORN_REUSE_PORT', 'true').lower() == 'true'
 
 # Worker processes
-workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
-worker_class = 'sync'
-worker_connections = 1000
+# Requests are I/O-bound (dominated by the Redis round-trip), so threaded workers
+# give us concurrency without paying for a full process per in-flight request.
+# Set GUNICORN_WORKER_CLASS=gevent to run each worker as an event loop instead:
+# the gevent worker monkey-patches the stdlib (and therefore redis-py's sockets)
+# on boot, so one process can hold worker_connections requests in flight while
+# they wait on Redis. A single worker per CPU is enough in that mode.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+default_workers = cpus if worker_class == 'gevent' else cpus * 2 + 1
+workers = int(os.getenv('GUNICORN_WORKERS', os.getenv('WEB_CONCURRENCY', default_workers)))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
 timeout = 30
 keepalive = 2
 
@@ -43,6 +79,7 @@ tmp_upload_dir = None
 def on_starting(server):
     """Called just before the master process is initialized."""
     server.log.info("Starting counter-service")
+    server.log.info("Available CPUs: %s, workers: %s, threads: %s", cpus, server.cfg.workers, server.cfg.threads)
 
 def when_ready(server):
     """Called just after the server is started."""
@@ -59,6 +96,15 @@ def pre_fork(server, worker):
 def post_fork(server, worker):
     """Called just after a worker has been forked."""
     server.log.info("Worker spawned (pid: %s)", worker.pid)
+    if worker_class == 'gevent':
+        # grpcio's C core (used by the OTLP trace exporter) blocks the gevent hub
+        # unless switched to gevent mode after monkey-patching and before any
+        # channel exists. The worker would patch later in init_process; patching
+        # here first is idempotent and runs before the app (and exporter) loads.
+        from gevent import monkey
+        monkey.patch_all()
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
 
 def post_worker_init(worker):
     """Called just after a worker has initialized the application."""
@@ -3,23 +3,44 @@ OpenTelemetry configuration for unified observability.
 """
 
 import os
+from grpc import Compression
 from opentelemetry import trace, metrics
+from opentelemetry.metrics import Observation
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
 from opentelemetry.sdk.resources import Resource
 
-# Global variables for Prometheus reader
+# Global providers state; setup runs once per process regardless of entry point
+_INITIALIZED = False
+_tracer = None
+_meter = None
 _prometheus_reader = None
 
 
+def _batch_span_processor(exporter):
+    """Wrap an exporter in a BatchSpanProcessor with explicit queue and batch sizing."""
+    return BatchSpanProcessor(
+        exporter,
+        max_queue_size=2048,
+        max_export_batch_size=512,
+        schedule_delay_millis=5000,
+    )
+
+
 def setup_opentelemetry():
     """
     Configure OpenTelemetry for traces and metrics.
     Returns the meter, tracer, and prometheus_reader instances.
+    Subsequent calls return the instances created by the first call.
     """
+    global _INITIALIZED, _tracer, _meter, _prometheus_reader
+    if _INITIALIZED:
+        return _tracer, _meter, _prometheus_reader
+
     # Create resource with service information
     resource = Resource.create({
         "service.name": os.getenv("OTEL_SERVICE_NAME", "counter-service"),
@@ -28,36 +49,43 @@ def setup_opentelemetry():
         "deployment.environment": os.getenv("OTEL_DEPLOYMENT_ENVIRONMENT", "production"),
     })
     
-    # Setup Tracer Provider
-    trace_provider = TracerProvider(resource=resource)
+    # Setup Tracer Provider with head sampling (honours upstream sampling decisions)
+    sample_ratio = float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "0.01"))
+    trace_provider = TracerProvider(
+        resource=resource,
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
     
     # Add OTLP exporter for traces (if OTLP endpoint is configured)
     otlp_endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
     if otlp_endpoint:
+        # gRPC keeps one persistent HTTP/2 channel to the collector; batches are gzipped protobuf
         otlp_exporter = OTLPSpanExporter(
-            endpoint=f"{otlp_endpoint}/v1/traces",
+            endpoint=otlp_endpoint,
             headers=os.getenv("OTEL_EXPORTER_OTLP_HEADERS", ""),
+            insecure=os.getenv("OTEL_EXPORTER_OTLP_INSECURE", "true").lower() == "true",
+            compression=Compression.Gzip,
         )
-        trace_provider.add_span_processor(BatchSpanProcessor(otlp_exporter))
+        trace_provider.add_span_processor(_batch_span_processor(otlp_exporter))
     else:
         # Use console exporter for development/debugging
         console_exporter = ConsoleSpanExporter()
-        trace_provider.add_span_processor(BatchSpanProcessor(console_exporter))
+        trace_provider.add_span_processor(_batch_span_processor(console_exporter))
     
     trace.set_tracer_provider(trace_provider)
-    tracer = trace.get_tracer(__name__)
+    _tracer = trace.get_tracer(__name__)
     
     # Setup Meter Provider with Prometheus exporter
-    global _prometheus_reader
     _prometheus_reader = PrometheusMetricReader()
     metrics_provider = MeterProvider(
         resource=resource,
         metric_readers=[_prometheus_reader],
     )
     metrics.set_meter_provider(metrics_provider)
-    meter = metrics.get_meter(__name__)
-    
-    return tracer, meter, _prometheus_reader
+    _meter = metrics.get_meter(__name__)
+
+    _INITIALIZED = True
+    return _tracer, _meter, _prometheus_reader
 
 
 def get_otel_metrics(meter):
@@ -78,13 +106,6 @@ def get_otel_metrics(meter):
         unit="s",
     )
     
-    # Counter value gauge
-    counter_gauge = meter.create_up_down_counter(
-        name="counter_value",
-        description="Current counter value",
-        unit="1",
-    )
-    
     # Redis connection status gauge
     redis_status = meter.create_up_down_counter(
         name="redis_connection_status",
@@ -109,8 +130,26 @@ def get_otel_metrics(meter):
     return {
         "http_requests": http_requests,
         "http_request_duration": http_request_duration,
-        "counter_value": counter_gauge,
         "redis_status": redis_status,
         "redis_operations": redis_operations,
         "redis_duration": redis_duration,
     }
+
+
+def register_counter_value_gauge(meter, redis_client, key="counter"):
+    """
+    Register an asynchronous gauge that reads the counter from Redis on collection.
+    """
+    def observe_counter_value(options):
+        try:
+            return [Observation(int(redis_client.get(key) or 0))]
+        except Exception:
+            # Skip this collection rather than report a bogus value
+            return []
+
+    return meter.create_observable_gauge(
+        name="counter_value",
+        callbacks=[observe_counter_value],
+        description="Current counter value",
+        unit="1",
+    )
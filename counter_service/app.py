@@ -1,43 +1,122 @@
 """
-Flask application for the counter service with OpenTelemetry and Rate Limiting.
+Flask application for the counter service with OpenTelemetry.
+
+Rate limiting is enforced by the Envoy proxy in front of the service.
 """
 
+import functools
 import os
 import logging
+import socket
+import threading
 import time
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pythonjsonlogger import jsonlogger
+import orjson
 import redis
-from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
+from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.instrumentation.redis import RedisInstrumentor
 from opentelemetry import trace
 
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-
-from config.otel_config import setup_opentelemetry, get_otel_metrics
+from config.otel_config import setup_opentelemetry, get_otel_metrics, register_counter_value_gauge
+from counter_service.batching import RedisCounterBatcher
 
 # Initialize OpenTelemetry
 tracer, meter, prometheus_reader = setup_opentelemetry()
 otel_metrics = get_otel_metrics(meter)
 
+# The counter endpoints have a fixed response schema, so their bodies are
+# rendered from byte templates instead of building a dict for jsonify.
+_GET_COUNTER_TEMPLATE = b'{"counter":%d,"message":"Counter retrieved successfully"}\n'
+_INCR_COUNTER_TEMPLATE = b'{"counter":%d,"message":"Counter incremented successfully"}\n'
+
+# Failures that mean "Redis is unreachable right now" and map to 503; the builtin
+# TimeoutError covers a pipelined operation not completing in time.
+_REDIS_UNAVAILABLE_ERRORS = (RedisConnectionError, RedisTimeoutError, TimeoutError)
+_REDIS_UNAVAILABLE_BODY = b'{"error":"Service temporarily unavailable","message":"Cannot connect to Redis"}\n'
+
+
+@functools.lru_cache(maxsize=256)
+def _http_request_attrs(method, endpoint, status=None):
+    """Return a shared metric attribute dict for an HTTP request (never mutate it)."""
+    if status is None:
+        return {"method": method, "endpoint": endpoint}
+    return {"method": method, "endpoint": endpoint, "status": status}
+
+
+# Metric attributes for the hot path, built once instead of per request
+_ATTRS_GET = _http_request_attrs("GET", "/")
+_ATTRS_GET_200 = _http_request_attrs("GET", "/", "200")
+_ATTRS_GET_503 = _http_request_attrs("GET", "/", "503")
+_ATTRS_POST = _http_request_attrs("POST", "/")
+_ATTRS_POST_200 = _http_request_attrs("POST", "/", "200")
+_ATTRS_POST_503 = _http_request_attrs("POST", "/", "503")
+_ATTRS_REDIS_GET = {"operation": "get"}
+_ATTRS_REDIS_GET_SUCCESS = {"operation": "get", "status": "success"}
+_ATTRS_REDIS_INCR = {"operation": "incr"}
+_ATTRS_REDIS_INCR_SUCCESS = {"operation": "incr", "status": "success"}
+
+
+def _orjson_dumps(obj, default=None, **kwargs):
+    """json.dumps-compatible serializer for python-json-logger backed by orjson."""
+    # Like the stock JsonEncoder, fall back to str() for values orjson can't encode
+    return orjson.dumps(obj, default=default or str).decode()
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes and parses with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        # Hand dates to DefaultJSONProvider.default (HTTP date format, as Flask does)
+        # and accept non-str dict keys like json.dumps does.
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class TraceJsonFormatter(jsonlogger.JsonFormatter):
+    """JSON formatter that leaves out trace/span ids on records logged outside a span."""
+
+    def add_fields(self, log_record, record, message_dict):
+        super().add_fields(log_record, record, message_dict)
+        # LoggingInstrumentor uses "0" when there is no active span
+        if log_record.get("trace_id") == "0":
+            log_record.pop("trace_id")
+            log_record.pop("span_id", None)
+
 
 def setup_logging():
     """Configure structured JSON logging."""
+    # Inject trace/span ids from the active OpenTelemetry context into every record;
+    # the formatter below renders them, so handlers don't format ids themselves.
+    LoggingInstrumentor().instrument(set_logging_format=False)
+
     log_handler = logging.StreamHandler()
-    formatter = jsonlogger.JsonFormatter(
-        '%(timestamp)s %(level)s %(name)s %(message)s',
-        timestamp=True
+    formatter = TraceJsonFormatter(
+        '%(timestamp)s %(level)s %(name)s %(message)s %(otelTraceID)s %(otelSpanID)s',
+        timestamp=True,
+        rename_fields={"otelTraceID": "trace_id", "otelSpanID": "span_id"},
+        # LoggingInstrumentor also sets these on every record; keep them out of the output
+        reserved_attrs=jsonlogger.RESERVED_ATTRS + ("otelServiceName", "otelTraceSampled"),
+        json_serializer=_orjson_dumps,
     )
     log_handler.setFormatter(formatter)
     
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    logger.addHandler(log_handler)
+    # Creating a second app in the same process must not duplicate every log line
+    if not any(isinstance(h.formatter, jsonlogger.JsonFormatter) for h in logger.handlers):
+        logger.addHandler(log_handler)
     
     return logger
 
@@ -61,7 +140,16 @@ def create_redis_client():
     else:
         password = os.getenv('REDIS_PASSWORD') or None
 
-    return redis.Redis(
+    # Keep idle connections alive so warm pool entries don't need a fresh TCP + AUTH handshake
+    socket_keepalive_options = {}
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        socket_keepalive_options[socket.TCP_KEEPIDLE] = 60
+
+    # A bounded, blocking pool shared by all threads in the worker: callers wait
+    # for a free connection instead of failing with "Too many connections".
+    pool = redis.BlockingConnectionPool(
+        max_connections=int(os.getenv('REDIS_POOL_SIZE', '32')),
+        timeout=5,
         host=host,
         port=port,
         password=password,
@@ -69,226 +157,151 @@ def create_redis_client():
         decode_responses=True,
         socket_connect_timeout=5,
         socket_timeout=5,
+        socket_keepalive=True,
+        socket_keepalive_options=socket_keepalive_options,
         retry_on_timeout=True
     )
 
+    return redis.Redis(connection_pool=pool)
+
 
 def create_app():
     """Create and configure the Flask application."""
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     logger = setup_logging()
     
     # Instrument Flask with OpenTelemetry
     FlaskInstrumentor().instrument_app(app)
     
     redis_client = None
-    limiter_storage_uri = "memory://" # Fallback to in-memory storage
-    limiter_storage_options = {}
+    counter_batcher = None
 
     try:
         redis_client = create_redis_client()
         redis_client.ping()
         RedisInstrumentor().instrument()
+        # Coalesce concurrent GET/INCR calls from worker threads into pipelines
+        counter_batcher = RedisCounterBatcher(redis_client)
+        register_counter_value_gauge(meter, redis_client)
         otel_metrics["redis_status"].add(1)
         logger.info("Redis connection established")
-        
-        # If Redis connection is successful, configure Limiter to use Redis
-        limiter_storage_uri = f"redis://{redis_client.connection_pool.connection_kwargs.get('host')}:{redis_client.connection_pool.connection_kwargs.get('port')}"
-        limiter_storage_options = {"password": redis_client.connection_pool.connection_kwargs.get('password')}
 
     except Exception as e:
-        logger.error("Failed to connect to Redis, falling back to in-memory rate limiting", extra={"error": str(e)})
+        logger.error("Failed to connect to Redis", extra={"error": str(e)})
         otel_metrics["redis_status"].add(-1)
-        # redis_client remains None, limiter will use memory storage
-
-    # Initialize Rate Limiter
-    limiter = Limiter(
-        get_remote_address,
-        app=app,
-        storage_uri=limiter_storage_uri,
-        storage_options=limiter_storage_options,
-        default_limits=["100 per minute", "10 per second"]
-    )
+        # Handlers treat a None client as "Redis unavailable"
+        redis_client = None
+        counter_batcher = None
+
+    # Per-worker read cache for GET /. Readers tolerate staleness up to the TTL and
+    # read the (value, expires_at) tuple without locking; writers take the lock.
+    counter_cache_ttl = float(os.getenv('COUNTER_CACHE_TTL', '0.05'))
+    counter_cache = {"entry": (None, 0.0)}
+    counter_cache_lock = threading.Lock()
+
+    def cache_counter(count, now):
+        with counter_cache_lock:
+            cached_count, expires_at = counter_cache["entry"]
+            # Concurrent INCRs can complete out of order; never move a live entry backwards
+            if cached_count is not None and now < expires_at and count < cached_count:
+                return
+            counter_cache["entry"] = (count, now + counter_cache_ttl)
+
+    def redis_unavailable(span, start_time, error, method, status_attrs, duration_attrs):
+        """Record and log a Redis failure, and return the 503 response."""
+        duration = time.perf_counter() - start_time
+        otel_metrics["http_requests"].add(1, status_attrs)
+        otel_metrics["http_request_duration"].record(duration, duration_attrs)
+        span.set_attribute("http.status_code", 503)
+        span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+
+        logger.error("Redis connection error", extra={
+            "method": method,
+            "path": "/",
+            "error": str(error),
+            "status": 503,
+        })
+        return Response(_REDIS_UNAVAILABLE_BODY, status=503, mimetype='application/json')
 
     @app.route('/', methods=['GET'])
     def get_counter():
         """Return the current counter value."""
-        start_time = time.time()
-        span = tracer.start_span("get_counter")
-        
-        try:
-            if redis_client is None:
-                raise RedisConnectionError("Redis not connected")
-            
-            # Get counter value from Redis with tracing
-            with tracer.start_as_current_span("redis_get") as redis_span:
-                redis_start = time.time()
-                value = redis_client.get('counter') or '0'
-                redis_duration = time.time() - redis_start
-                count = int(value)
-                
+        with tracer.start_as_current_span("get_counter") as span:
+            start_time = time.perf_counter()
+            if counter_batcher is None:
+                return redis_unavailable(span, start_time, "Redis not connected", "GET", _ATTRS_GET_503, _ATTRS_GET)
+
+            now = time.monotonic()
+            count, expires_at = counter_cache["entry"]
+            if count is None or now >= expires_at:
+                try:
+                    count = counter_batcher.get()
+                except _REDIS_UNAVAILABLE_ERRORS as e:
+                    return redis_unavailable(span, start_time, e, "GET", _ATTRS_GET_503, _ATTRS_GET)
+                redis_duration = time.perf_counter() - start_time
+                cache_counter(count, now)
+
                 # Record Redis metrics
-                otel_metrics["redis_operations"].add(1, {"operation": "get", "status": "success"})
-                otel_metrics["redis_duration"].record(redis_duration, {"operation": "get"})
-                redis_span.set_attribute("redis.operation", "get")
-                redis_span.set_attribute("redis.key", "counter")
-                redis_span.set_attribute("counter.value", count)
-            
-            # Record counter value
-            otel_metrics["counter_value"].add(count)
-            
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "GET", "endpoint": "/", "status": "200"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "GET", "endpoint": "/"})
-            
+                otel_metrics["redis_operations"].add(1, _ATTRS_REDIS_GET_SUCCESS)
+                otel_metrics["redis_duration"].record(redis_duration, _ATTRS_REDIS_GET)
+
+            duration = time.perf_counter() - start_time
+            otel_metrics["http_requests"].add(1, _ATTRS_GET_200)
+            otel_metrics["http_request_duration"].record(duration, _ATTRS_GET)
+
             span.set_attribute("http.method", "GET")
             span.set_attribute("http.status_code", 200)
             span.set_attribute("counter.value", count)
-            
-            logger.info("Counter retrieved", extra={
-                "method": "GET",
-                "path": "/",
-                "counter": count,
-                "status": 200,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-                "span_id": format(span.get_span_context().span_id, "016x"),
-            })
-            
-            return jsonify({
-                "counter": count,
-                "message": "Counter retrieved successfully"
-            }), 200
-            
-        except RedisConnectionError as e:
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "GET", "endpoint": "/", "status": "503"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "GET", "endpoint": "/"})
-            span.set_attribute("http.status_code", 503)
-            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-            
-            logger.error("Redis connection error", extra={
-                "method": "GET",
-                "path": "/",
-                "error": str(e),
-                "status": 503,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-            })
-            return jsonify({
-                "error": "Service temporarily unavailable",
-                "message": "Cannot connect to Redis"
-            }), 503
-            
-        except Exception as e:
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "GET", "endpoint": "/", "status": "500"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "GET", "endpoint": "/"})
-            span.set_attribute("http.status_code", 500)
-            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-            
-            logger.error("Internal server error", extra={
-                "method": "GET",
-                "path": "/",
-                "error": str(e),
-                "status": 500,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-            })
-            return jsonify({
-                "error": "Internal server error",
-                "message": str(e)
-            }), 500
-        finally:
-            span.end()
-    
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Counter retrieved", extra={
+                    "method": "GET",
+                    "path": "/",
+                    "counter": count,
+                    "status": 200,
+                })
+
+            return Response(_GET_COUNTER_TEMPLATE % count, status=200, mimetype='application/json')
+
     @app.route('/', methods=['POST'])
     def increment_counter():
         """Increment the counter and return the new value."""
-        start_time = time.time()
-        span = tracer.start_span("increment_counter")
-        
-        try:
-            if redis_client is None:
-                raise RedisConnectionError("Redis not connected")
-            
-            # Increment counter in Redis with tracing
-            with tracer.start_as_current_span("redis_incr") as redis_span:
-                redis_start = time.time()
-                count = redis_client.incr('counter')
-                redis_duration = time.time() - redis_start
-                
-                # Record Redis metrics
-                otel_metrics["redis_operations"].add(1, {"operation": "incr", "status": "success"})
-                otel_metrics["redis_duration"].record(redis_duration, {"operation": "incr"})
-                redis_span.set_attribute("redis.operation", "incr")
-                redis_span.set_attribute("redis.key", "counter")
-                redis_span.set_attribute("counter.value", count)
-            
-            # Record counter value
-            otel_metrics["counter_value"].add(count)
-            
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "POST", "endpoint": "/", "status": "200"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "POST", "endpoint": "/"})
-            
+        with tracer.start_as_current_span("increment_counter") as span:
+            start_time = time.perf_counter()
+            if counter_batcher is None:
+                return redis_unavailable(span, start_time, "Redis not connected", "POST", _ATTRS_POST_503, _ATTRS_POST)
+
+            try:
+                count = counter_batcher.incr()
+            except _REDIS_UNAVAILABLE_ERRORS as e:
+                return redis_unavailable(span, start_time, e, "POST", _ATTRS_POST_503, _ATTRS_POST)
+            redis_duration = time.perf_counter() - start_time
+            cache_counter(count, time.monotonic())
+
+            # Record Redis metrics
+            otel_metrics["redis_operations"].add(1, _ATTRS_REDIS_INCR_SUCCESS)
+            otel_metrics["redis_duration"].record(redis_duration, _ATTRS_REDIS_INCR)
+
+            duration = time.perf_counter() - start_time
+            otel_metrics["http_requests"].add(1, _ATTRS_POST_200)
+            otel_metrics["http_request_duration"].record(duration, _ATTRS_POST)
+
             span.set_attribute("http.method", "POST")
             span.set_attribute("http.status_code", 200)
             span.set_attribute("counter.value", count)
-            
-            logger.info("Counter incremented", extra={
-                "method": "POST",
-                "path": "/",
-                "counter": count,
-                "status": 200,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-                "span_id": format(span.get_span_context().span_id, "016x"),
-            })
-            
-            return jsonify({
-                "counter": count,
-                "message": "Counter incremented successfully"
-            }), 200
-            
-        except RedisConnectionError as e:
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "POST", "endpoint": "/", "status": "503"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "POST", "endpoint": "/"})
-            span.set_attribute("http.status_code", 503)
-            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-            
-            logger.error("Redis connection error", extra={
-                "method": "POST",
-                "path": "/",
-                "error": str(e),
-                "status": 503,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-            })
-            return jsonify({
-                "error": "Service temporarily unavailable",
-                "message": "Cannot connect to Redis"
-            }), 503
-            
-        except Exception as e:
-            duration = time.time() - start_time
-            otel_metrics["http_requests"].add(1, {"method": "POST", "endpoint": "/", "status": "500"})
-            otel_metrics["http_request_duration"].record(duration, {"method": "POST", "endpoint": "/"})
-            span.set_attribute("http.status_code", 500)
-            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
-            
-            logger.error("Internal server error", extra={
-                "method": "POST",
-                "path": "/",
-                "error": str(e),
-                "status": 500,
-                "trace_id": format(span.get_span_context().trace_id, "032x"),
-            })
-            return jsonify({
-                "error": "Internal server error",
-                "message": str(e)
-            }), 500
-        finally:
-            span.end()
-    
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Counter incremented", extra={
+                    "method": "POST",
+                    "path": "/",
+                    "counter": count,
+                    "status": 200,
+                })
+
+            return Response(_INCR_COUNTER_TEMPLATE % count, status=200, mimetype='application/json')
+
     @app.route('/health', methods=['GET'])
-    @limiter.exempt
     def health_check():
         """Health check endpoint for Kubernetes probes."""
         span = tracer.start_span("health_check")
@@ -326,34 +339,63 @@ def create_app():
         finally:
             span.end()
     
+    # Serialized /metrics output is reused for a short window so that concurrent or
+    # back-to-back scrapes don't each walk every collector.
+    metrics_cache_ttl = float(os.getenv('METRICS_CACHE_TTL', '1.0'))
+    metrics_cache = {"body": None, "expires_at": 0.0}
+    metrics_cache_lock = threading.Lock()
+
     @app.route('/metrics', methods=['GET'])
-    @limiter.exempt
     def metrics_endpoint():
         """Prometheus metrics endpoint (OpenTelemetry + Prometheus client)."""
-        try:
-            # OpenTelemetry Prometheus exporter provides metrics via get_metrics_data
-            # The PrometheusMetricReader integrates with the prometheus_client's default registry.
-            # Calling generate_latest() will automatically collect metrics from all registered
-            # collectors, including the one from OpenTelemetry.
-            return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
-        except Exception as e:
-            # Fallback to legacy metrics if OpenTelemetry export fails
-            logger.warning("Failed to export OpenTelemetry metrics", extra={"error": str(e)})
-            return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+        now = time.monotonic()
+        if now >= metrics_cache["expires_at"]:
+            with metrics_cache_lock:
+                # Another thread may have refreshed the cache while we waited
+                if now >= metrics_cache["expires_at"]:
+                    try:
+                        # The PrometheusMetricReader integrates with the prometheus_client's default registry.
+                        # Calling generate_latest() will automatically collect metrics from all registered
+                        # collectors, including the one from OpenTelemetry.
+                        metrics_cache["body"] = generate_latest()
+                        metrics_cache["expires_at"] = now + metrics_cache_ttl
+                    except Exception as e:
+                        logger.warning("Failed to export OpenTelemetry metrics", extra={"error": str(e)})
+                        # Serve the last successful scrape if there is one; otherwise fail the
+                        # scrape instead of returning an empty 200 that hides the error
+                        if metrics_cache["body"] is None:
+                            raise
+        return metrics_cache["body"], 200, {'Content-Type': CONTENT_TYPE_LATEST}
     
     @app.errorhandler(404)
     def not_found(error):
         """Handle 404 errors."""
-        otel_metrics["http_requests"].add(1, {"method": request.method, "endpoint": request.path, "status": "404"})
+        otel_metrics["http_requests"].add(1, _http_request_attrs(request.method, request.path, "404"))
         return jsonify({
             "error": "Not found",
             "message": f"The endpoint {request.path} does not exist"
         }), 404
     
+    @app.errorhandler(500)
+    def internal_server_error(error):
+        """Handle unexpected errors raised by request handlers."""
+        error = getattr(error, "original_exception", None) or error
+        otel_metrics["http_requests"].add(1, _http_request_attrs(request.method, request.path, "500"))
+        logger.error("Internal server error", extra={
+            "method": request.method,
+            "path": request.path,
+            "error": str(error),
+            "status": 500,
+        })
+        return jsonify({
+            "error": "Internal server error",
+            "message": str(error)
+        }), 500
+
     @app.errorhandler(405)
     def method_not_allowed(error):
         """Handle 405 errors."""
-        otel_metrics["http_requests"].add(1, {"method": request.method, "endpoint": request.path, "status": "405"})
+        otel_metrics["http_requests"].add(1, _http_request_attrs(request.method, request.path, "405"))
         return jsonify({
             "error": "Method not allowed",
             "message": f"Method {request.method} is not allowed for {request.path}"
@@ -2,11 +2,8 @@
 WSGI entry point for Gunicorn.
 """
 
-from counter_service.app import create_app
-
-# Create the application instance
-application = create_app()
+# Reuse the application created in __main__ instead of building a second one
+from counter_service.__main__ import app as application
 
 if __name__ == '__main__':
     application.run()
-
@@ -0,0 +1,68 @@
+"""
+Tests for the Redis counter batcher.
+"""
+
+import threading
+import unittest
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from counter_service.batching import RedisCounterBatcher
+
+
+class FailingPipeline:
+    """Pipeline stub whose execute() always fails like a dropped connection."""
+
+    def __init__(self, started):
+        self.started = started
+
+    def get(self, key):
+        pass
+
+    def incr(self, key):
+        pass
+
+    def execute(self):
+        # Give the other callers time to queue up behind this batch
+        self.started.wait(timeout=1)
+        raise RedisConnectionError("Connection reset by peer")
+
+
+class FailingRedis:
+    def __init__(self):
+        self.started = threading.Event()
+
+    def pipeline(self, transaction=True):
+        return FailingPipeline(self.started)
+
+
+class RedisCounterBatcherFailureTest(unittest.TestCase):
+    def test_each_caller_gets_its_own_exception(self):
+        client = FailingRedis()
+        batcher = RedisCounterBatcher(client, timeout=5)
+        errors = []
+        errors_lock = threading.Lock()
+
+        def call():
+            try:
+                batcher.incr()
+            except RedisConnectionError as e:
+                with errors_lock:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        client.started.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 50)
+        self.assertEqual(len({id(e) for e in errors}), 50)
+        for error in errors:
+            self.assertIsInstance(error.__cause__, RedisConnectionError)
+            self.assertEqual(str(error), "Connection reset by peer")
+
+
+if __name__ == '__main__':
+    unittest.main()